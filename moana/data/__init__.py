@@ -1,4 +1,8 @@
 from data import utils
 from data import transform
 from data import dataset
-from data import plot
\ No newline at end of file
+from data import plot
+from data import geometry
+from data import rasterize
+from data import pyramid
+from data import batch
\ No newline at end of file
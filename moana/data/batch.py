@@ -0,0 +1,141 @@
+import numpy as np
+
+import torch
+from torch.utils.data import Dataset, DataLoader, RandomSampler, SequentialSampler
+
+try:
+    from .dataset import ReadAheadBatch, ReadAheadBatchSampler
+except ImportError:
+    # imported as a script module alongside extract.py
+    from dataset import ReadAheadBatch, ReadAheadBatchSampler
+
+
+class SharedBatchBuffers:
+
+    def __init__(self, slots, batch_size, pixel_dim, channels=3):
+        """
+        A ring of preallocated uint8 image and label batches in shared
+        memory, written in place by DataLoader workers.
+        """
+        H, W = pixel_dim
+        self.slots = slots
+        self.images = torch.zeros((slots, batch_size, H, W, channels), dtype=torch.uint8).share_memory_()
+        self.labels = torch.zeros((slots, batch_size, H, W), dtype=torch.uint8).share_memory_()
+
+
+class SlotBatchSampler:
+
+    def __init__(self, sampler, batch_size, slots, num_workers=0, drop_last=False):
+        """
+        Batch a sampler, tagging every index with the ring slot its
+        batch is written to. Like ReadAheadBatchSampler, each batch
+        carries the indices its worker fetches next as upcoming.
+        """
+        self.batch_sampler = ReadAheadBatchSampler(sampler, batch_size, num_workers, drop_last)
+        self.slots = slots
+
+    def __iter__(self):
+        for n, batch in enumerate(self.batch_sampler):
+            items = ReadAheadBatch((n % self.slots, idx) for idx in batch)
+            items.upcoming = batch.upcoming
+            yield items
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+class SharedBatchDataset(Dataset):
+
+    def __init__(self, dataset, buffers):
+        """
+        Wrap a dataset so that a batch is written into a slot of the
+        shared buffers and only (slot, size) crosses the worker
+        boundary.
+        """
+        self.dataset = dataset
+        self.buffers = buffers
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, item):
+        return self.__getitems__([item])
+
+    def __getitems__(self, items):
+        slot = items[0][0]
+        indices = ReadAheadBatch(idx for _, idx in items)
+        indices.upcoming = getattr(items, "upcoming", ())
+        if hasattr(self.dataset, "__getitems__"):
+            samples = self.dataset.__getitems__(indices)
+        else:
+            samples = [self.dataset[idx] for idx in indices]
+        for n, (image, label) in enumerate(samples):
+            np.copyto(self.buffers.images[slot, n].numpy(), np.asarray(image))
+            np.copyto(self.buffers.labels[slot, n].numpy(), np.asarray(label))
+        return slot, len(samples)
+
+
+def _collate(batch):
+    return batch
+
+
+class SharedBatchLoader:
+
+    def __init__(self, dataset, batch_size, pixel_dim, shuffle=False, sampler=None, num_workers=0,
+                 prefetch_factor=2, pin_memory=False, mean=None, std=None, drop_last=False, channels=3):
+        """
+        A DataLoader for MoanaDataset that collates into shared memory.
+
+        Workers write uint8 pixels and labels straight into a ring of
+        SharedBatchBuffers instead of returning per-sample float tensors
+        to be collated and pickled. The conversion to float, scaling to
+        [0, 1] and optional normalization by mean and std run once per
+        batch in the main process.
+
+        Note: The dataset transform must end in uint8 arrays or PIL
+              images of size pixel_dim with the given number of
+              channels (i.e. without ToTensor). With
+              pin_memory the float batches live in two reused pinned
+              buffers, so a batch must be consumed (e.g. copied to the
+              device) before the next but one is drawn.
+        """
+        if sampler is None:
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+
+        # batches in flight in the workers, plus the one being converted
+        slots = num_workers * prefetch_factor + 2
+        self.buffers = SharedBatchBuffers(slots, batch_size, pixel_dim, channels=channels)
+        self.batch_sampler = SlotBatchSampler(sampler, batch_size, slots, num_workers=num_workers,
+                                              drop_last=drop_last)
+        self.loader = DataLoader(
+            SharedBatchDataset(dataset, self.buffers),
+            batch_sampler=self.batch_sampler,
+            collate_fn=_collate,
+            num_workers=num_workers,
+            prefetch_factor=prefetch_factor if num_workers else None
+        )
+
+        self.mean = None if mean is None else torch.tensor(mean).view(-1, 1, 1)
+        self.std = None if std is None else torch.tensor(std).view(-1, 1, 1)
+
+        self.pinned = None
+        if pin_memory:
+            H, W = pixel_dim
+            self.pinned = [torch.empty((batch_size, channels, H, W)).pin_memory() for _ in range(2)]
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for n, (slot, size) in enumerate(self.loader):
+            images = self.buffers.images[slot, :size].permute(0, 3, 1, 2)
+            if self.pinned is None:
+                x = images.float()
+            else:
+                x = self.pinned[n % 2][:size]
+                x.copy_(images)
+            x.div_(255)
+            if self.mean is not None:
+                x.sub_(self.mean).div_(self.std)
+            y = self.buffers.labels[slot, :size].long()
+            yield x, y
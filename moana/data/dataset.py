@@ -1,17 +1,32 @@
 import os
 import random
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 from skimage import io
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler, BatchSampler
 
 
 class MoanaDataset(Dataset):
 
-    def __init__(self, root_dir, pixel_dim, N=None, transform=None, empty=False):
+    def __init__(self, root_dir, pixel_dim, N=None, transform=None, empty=False, io_threads=8, max_pending=64):
+        """
+        Note: Reads are issued on a pool of io_threads threads by
+              __getitems__ and prefetch, so that the latency of
+              network storage overlaps with decoding and compute.
+              At most max_pending prefetched samples are held; the
+              oldest are dropped beyond that.
+        """
+        self.io_threads = io_threads
+        self.max_pending = max_pending
+        self._pid = os.getpid()
+        self._executor = None
+        self._pending = {}
         if not empty:
             self.init_from_args(root_dir, pixel_dim, N=N, transform=transform)
         
@@ -37,17 +52,91 @@ class MoanaDataset(Dataset):
 
     
     def __getitem__(self, idx):
+        self._check_process()
+        future = self._pending.pop(idx, None)
+        if future is None:
+            sample = self._read(idx)
+        else:
+            sample = future.result()
+        return self._apply_transform(sample)
+
+
+    def __getitems__(self, indices):
+        """
+        Fetch a batch, reading all of its files concurrently. If the
+        batch comes from a ReadAheadBatchSampler, the reads of the
+        next batch this process will fetch are started as well.
+        """
+        self._check_process()
+        futures = []
+        for idx in indices:
+            future = self._pending.pop(idx, None)
+            if future is None:
+                future = self._submit(idx)
+            futures.append(future)
+        self.prefetch(getattr(indices, "upcoming", ()))
+        return [self._apply_transform(future.result()) for future in futures]
+
+
+    def prefetch(self, indices):
+        """
+        Start reading samples that will be requested soon.
+        """
+        self._check_process()
+        for idx in indices:
+            if idx in self._pending:
+                continue
+            while len(self._pending) >= self.max_pending:
+                self._pending.pop(next(iter(self._pending))).cancel()
+            self._pending[idx] = self._submit(idx)
+
+
+    def cancel_prefetch(self):
+        self._check_process()
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_pending"] = {}
+        return state
+
+
+    def _check_process(self):
+        """
+        A forked DataLoader worker inherits the parent's executor,
+        whose threads do not exist in the child, and futures that
+        will never complete. Start afresh in a new process.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = None
+            self._pending = {}
+
+
+    def _submit(self, idx):
+        self._check_process()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.io_threads)
+        return self._executor.submit(self._read, idx)
+
+
+    def _read(self, idx):
         image_name = os.path.join(self.images_dir, self.file_names[idx])
         label_name = os.path.join(self.labels_dir, self.file_names[idx])
         
         image = self._crop(io.imread(image_name)[:, :, :3])
         label = self._aggregate_label(self._crop(io.imread(label_name)))
-                
-        sample = (image, label)
+        
+        return image, label
 
+
+    def _apply_transform(self, sample):
         if self.transform:
             sample = self.transform(sample)
-
         return sample
     
 
@@ -73,8 +162,8 @@ class MoanaDataset(Dataset):
     
     @classmethod
     def split(cls, dataset, split):
-        dataset_0 = MoanaDataset(None, None, empty=True)
-        dataset_1 = MoanaDataset(None, None, empty=True)
+        dataset_0 = MoanaDataset(None, None, empty=True, io_threads=dataset.io_threads, max_pending=dataset.max_pending)
+        dataset_1 = MoanaDataset(None, None, empty=True, io_threads=dataset.io_threads, max_pending=dataset.max_pending)
         
         dataset_0.root_dir = dataset.root_dir
         dataset_0.pixel_dim = dataset.pixel_dim
@@ -93,6 +182,97 @@ class MoanaDataset(Dataset):
         dataset_1.file_names = list(set(dataset.file_names) - set(dataset_0.file_names))
         
         return dataset_0, dataset_1
-        
-        
-        
\ No newline at end of file
+
+
+class ReadAheadBatch(list):
+    """
+    A batch of indices that also carries the indices of the next
+    batch the same process will fetch.
+    """
+    upcoming = ()
+
+
+class ReadAheadBatchSampler(Sampler):
+
+    def __init__(self, sampler, batch_size, num_workers=0, drop_last=False):
+        """
+        Batch a sampler so that each batch tells the dataset which
+        batch its process fetches next, letting every DataLoader
+        worker read ahead in its own copy of the dataset.
+
+        Note: DataLoader hands batches to workers in turn, so the next
+              batch of the worker fetching batch n is batch
+              n + num_workers (n + 1 without workers). num_workers
+              must match the DataLoader.
+        """
+        self.batch_sampler = BatchSampler(sampler, batch_size, drop_last)
+        self.lookahead = max(num_workers, 1)
+
+    def __iter__(self):
+        batches = iter(self.batch_sampler)
+        ahead = deque(ReadAheadBatch(batch) for batch in itertools.islice(batches, self.lookahead + 1))
+        while ahead:
+            batch = ahead.popleft()
+            for upcoming in itertools.islice(batches, 1):
+                ahead.append(ReadAheadBatch(upcoming))
+            if len(ahead) >= self.lookahead:
+                batch.upcoming = list(ahead[self.lookahead - 1])
+            yield batch
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+class ResumableRandomSampler(Sampler):
+
+    def __init__(self, data_source, seed=0):
+        """
+        A random sampler that can resume mid-epoch.
+
+        Each epoch draws a permutation from a generator seeded by
+        seed + epoch, so the order is reproducible. The training loop
+        reports consumed samples with advance (e.g. from an ignite
+        ITERATION_COMPLETED handler); the DataLoader prefetches ahead
+        of what has been trained on, so the sampler cannot count
+        them itself.
+
+        The epoch ends with end_epoch (e.g. from EPOCH_COMPLETED, and
+        before a checkpoint taken there), or otherwise when the next
+        iteration starts after the DataLoader exhausted this one. It
+        does not depend on every sample being consumed, which a
+        drop_last DataLoader never does.
+        """
+        self.data_source = data_source
+        self.seed = seed
+        self.epoch = 0
+        self.position = 0
+        self._exhausted = False
+
+    def __iter__(self):
+        if self._exhausted:
+            self.end_epoch()
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.data_source), generator=generator).tolist()
+        yield from order[self.position:]
+        self._exhausted = True
+
+    def __len__(self):
+        return len(self.data_source) - self.position
+
+    def advance(self, n):
+        self.position += n
+
+    def end_epoch(self):
+        self.epoch += 1
+        self.position = 0
+        self._exhausted = False
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch, "position": self.position}
+
+    def load_state_dict(self, state):
+        self.seed = state["seed"]
+        self.epoch = state["epoch"]
+        self.position = state["position"]
+        self._exhausted = False
@@ -1,13 +1,15 @@
 import os
+import json
 import shutil
 
+import numpy as np
 from tqdm.notebook import tqdm
 from skimage import io
 
 from arcpy import (
     env,
-    Array,
-    Polygon,
+    AsShape,
+    Raster,
     Buffer_analysis,
     EliminatePolygonPart_management,
     GeneratePointsAlongLines_management,
@@ -15,7 +17,7 @@ from arcpy import (
     Clip_management,
     FeatureToRaster_conversion
 )
-from arcpy.da import UpdateCursor, SearchCursor, TableToNumPyArray
+from arcpy.da import UpdateCursor, SearchCursor
 
 from utils import (
     path_to_shoreline, 
@@ -25,6 +27,8 @@ from utils import (
     path_to_masks,
     path_to_temp
 )
+from geometry import GeometryStore, ring_windows
+from rasterize import PolygonIndex, snap_window, check_codes, rasterize_windows
 
 
 def create_shoreline_rectangles(islands, config):
@@ -51,7 +55,27 @@ def create_shoreline_rectangles(islands, config):
     _envelop_shoreline_points(islands)
     
     
-def create_image_rectangles(islands):
+def create_shoreline_windows(islands, config):
+    """
+    Window extents along the outer shoreline, computed from the
+    columnar geometry instead of the arcpy buffer pipeline. Saves
+    an (N, 4) array of (xmin, ymin, xmax, ymax) per island, used
+    in place of the rects5 rectangles by the image and mask
+    extraction with windows=True.
+    """
+    size = config["pix_res"] * config["data_extraction"]["pix_dim"]
+    step = int(size * (1 - config["data_extraction"]["overlap"]))
+    
+    for island in islands:
+        ring = _load_geometry(path_to_shoreline(island)).largest_ring()
+        windows = ring_windows(ring, size, step, int(size * (3 / 8)))
+        
+        out = os.path.join(path_to_temp(), "windows", f"{island}{os.extsep}npy")
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        np.save(out, windows)
+    
+    
+def create_image_rectangles(islands, windows=False):
     
     for island in islands:
         
@@ -62,12 +86,15 @@ def create_image_rectangles(islands):
             continue
         
         # get rectangle extents
-        path_to_rects = os.path.join(path_to_temp(), "rects5", f"{island}.shp")
-        with SearchCursor(path_to_rects, ["OID@", "SHAPE@"]) as cursor:
-            rectangles = []
-            for oid, rect in cursor:
-                extent = " ".join(str(rect.extent).split()[:4])
-                rectangles.append((oid, extent))
+        if windows:
+            rectangles = [(oid, " ".join(map(str, extent))) for oid, extent in _read_windows(island)]
+        else:
+            path_to_rects = os.path.join(path_to_temp(), "rects5", f"{island}.shp")
+            with SearchCursor(path_to_rects, ["OID@", "SHAPE@"]) as cursor:
+                rectangles = []
+                for oid, rect in cursor:
+                    extent = " ".join(str(rect.extent).split()[:4])
+                    rectangles.append((oid, extent))
         
         # clip image mosaic to rectangles and save
         for oid, extent in tqdm(rectangles):
@@ -85,7 +112,7 @@ def create_image_rectangles(islands):
                 os.remove(os.path.join(_path_to_images, name))
                 
                 
-def create_mask_rectangles(islands):
+def create_mask_rectangles(islands, windows=False):
     
     for island in islands:
         
@@ -95,12 +122,15 @@ def create_mask_rectangles(islands):
             _rasterize_habitat([island])
         
         # get rectangle extents
-        path_to_rects = os.path.join(path_to_temp(), "rects5", f"{island}.shp")
-        with SearchCursor(path_to_rects, ["OID@", "SHAPE@"]) as cursor:
-            rectangles = []
-            for oid, rect in cursor:
-                extent = " ".join(str(rect.extent).split()[:4])
-                rectangles.append((oid, extent))
+        if windows:
+            rectangles = [(oid, " ".join(map(str, extent))) for oid, extent in _read_windows(island)]
+        else:
+            path_to_rects = os.path.join(path_to_temp(), "rects5", f"{island}.shp")
+            with SearchCursor(path_to_rects, ["OID@", "SHAPE@"]) as cursor:
+                rectangles = []
+                for oid, rect in cursor:
+                    extent = " ".join(str(rect.extent).split()[:4])
+                    rectangles.append((oid, extent))
         
         # clip mask raster to rectangles and save
         for oid, extent in tqdm(rectangles):
@@ -118,6 +148,54 @@ def create_mask_rectangles(islands):
                 os.remove(os.path.join(_path_to_masks, name))
                 
                 
+def rasterize_mask_rectangles(islands, config, workers=None, check=8, windows=False):
+    """
+    Rasterize the habitat polygons directly into each rectangle
+    on the mosaic pixel grid, without an island-wide raster.
+    
+    Note: The M_STRUCT to mask code mapping is taken from the
+          habitat_codes entry of the config if set, otherwise from
+          the attribute table of the arcpy habitat raster (see
+          _habitat_codes). Before writing, the first check
+          rectangles that already have an arcpy mask are compared
+          against it.
+    """
+    config_codes = config["data_extraction"].get("habitat_codes")
+    
+    for island in islands:
+        
+        # get mosaic pixel grid
+        snap_raster = path_to_mosaic(island)
+        if len(snap_raster) > 1:
+            print(f"Please merge {island} mosaics. Skipping...")
+            continue
+        grid_origin, cell = _mosaic_grid(snap_raster[0])
+        
+        # index habitat polygons
+        codes = config_codes or _habitat_codes(island)
+        index = PolygonIndex(_load_geometry(path_to_habitat(island), ["M_STRUCT"]), codes)
+        
+        # get rectangle windows
+        if windows:
+            rectangles = _read_windows(island)
+        else:
+            path_to_rects = os.path.join(path_to_temp(), "rects5", f"{island}.shp")
+            rectangles = enumerate(_load_geometry(path_to_rects).bounds())
+        jobs = []
+        for oid, extent in rectangles:
+            origin, shape = snap_window(extent, grid_origin, cell)
+            path_to_raster = os.path.join(path_to_masks(), f"{island}-{oid}.png")
+            jobs.append((path_to_raster, origin, shape))
+        
+        # check codes against existing masks
+        existing = [job for job in jobs if os.path.exists(job[0])]
+        if check_codes(index, existing[:check], cell) is None:
+            print(f"No existing {island} masks to check habitat codes against. Writing unchecked...")
+        
+        # rasterize windows and save
+        rasterize_windows(index, jobs, cell, workers=workers)
+
+                
 def post_process_rasters(islands, config):
     D = config["data_extraction"]["pix_dim"]
     
@@ -147,21 +225,16 @@ def _trim_shoreline(islands):
     """
     for island in islands:
         path = path_to_shoreline(island)
-        pair = max(TableToNumPyArray(path, ["OID@", "SHAPE@AREA"]), key=lambda p: p[1])
+        store = _load_geometry(path)
+        keep = int(np.argmax(store.feature_areas()))
+        rings = store.select([keep]).exteriors().rings(0)
+        shape = AsShape({"rings": [ring.tolist() for ring in rings]}, True)
         with UpdateCursor(path, ["OID@", "SHAPE@"]) as cursor:
             for row in cursor:
-                if row[0] != pair[0]:
+                if row[0] != keep:
                     cursor.deleteRow()
                 else:
-                    row_new = Array()
-                    for part in row[1]:
-                        part_new = Array()
-                        for point in part:
-                            if point is None:
-                                break
-                            part_new.add(point)
-                        row_new.add(part_new)
-                    row[1] = Polygon(row_new)
+                    row[1] = shape
                     cursor.updateRow(row)
                     
                     
@@ -272,3 +345,59 @@ def _rasterize_habitat(islands):
             out_raster, 
             "#"
         )
+
+
+def _load_geometry(path, fields=()):
+    """
+    Load a shapefile as a GeometryStore, cached as npz in the temp
+    directory until the shapefile geometry or attributes are modified.
+    """
+    name = f"{os.path.basename(os.path.dirname(path))}-{os.path.splitext(os.path.basename(path))[0]}"
+    cache = os.path.join(path_to_temp(), "geometry", f"{name}{os.extsep}npz")
+    sources = [path, os.path.splitext(path)[0] + os.extsep + "dbf"]
+    modified = max(os.path.getmtime(source) for source in sources if os.path.exists(source))
+    if os.path.exists(cache) and os.path.getmtime(cache) >= modified:
+        store = GeometryStore.load(cache)
+        if all(field in store.attributes for field in fields):
+            return store
+    store = GeometryStore.from_shapefile(path, fields)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    store.save(cache)
+    return store
+
+
+def _habitat_codes(island):
+    """
+    The M_STRUCT to raw mask code mapping of the arcpy habitat
+    raster, read from its attribute table and cached as json.
+    """
+    path = os.path.join(path_to_temp(), "habitats", f"{island}{os.extsep}json")
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    
+    in_raster = os.path.join(path_to_temp(), "habitats", f"{island}.tif")
+    if not os.path.exists(in_raster):
+        _rasterize_habitat([island])
+    with SearchCursor(in_raster, ["Value", "M_STRUCT"]) as cursor:
+        codes = {value: code for code, value in cursor}
+    
+    with open(path, "w") as f:
+        json.dump(codes, f)
+    return codes
+
+
+def _read_windows(island):
+    """
+    The (oid, extent) pairs saved by create_shoreline_windows.
+    """
+    path = os.path.join(path_to_temp(), "windows", f"{island}{os.extsep}npy")
+    return list(enumerate(np.load(path).tolist()))
+
+
+def _mosaic_grid(path):
+    """
+    The upper-left corner and cell size of a mosaic.
+    """
+    raster = Raster(path)
+    return (raster.extent.XMin, raster.extent.YMax), raster.meanCellWidth
@@ -0,0 +1,379 @@
+import os
+import struct
+
+import numpy as np
+
+
+def _ranges(starts, ends):
+    """
+    Concatenate the index ranges [starts[i], ends[i]).
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    total = lengths.sum()
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+
+
+def _offsets(lengths):
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+
+def _read_shp(path):
+    """
+    Read polygon geometry from a shapefile. Each record becomes a
+    feature and each ESRI part becomes a ring.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    coords = []
+    ring_lengths = []
+    feature_rings = []
+
+    pos = 100
+    while pos < len(data):
+        _, length = struct.unpack(">ii", data[pos:pos + 8])
+        content = pos + 8
+        pos = content + 2 * length
+
+        shape_type, = struct.unpack("<i", data[content:content + 4])
+        if shape_type == 0:
+            feature_rings.append(0)
+            continue
+        n_parts, n_points = struct.unpack("<ii", data[content + 36:content + 44])
+        parts = np.frombuffer(data, dtype="<i4", count=n_parts, offset=content + 44)
+        points = np.frombuffer(data, dtype="<f8", count=2 * n_points, offset=content + 44 + 4 * n_parts)
+
+        coords.append(points.reshape(-1, 2))
+        ring_lengths.append(np.diff(np.append(parts, n_points)))
+        feature_rings.append(n_parts)
+
+    coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+    ring_lengths = np.concatenate(ring_lengths) if ring_lengths else np.zeros(0, dtype=np.int64)
+    return coords, _offsets(ring_lengths), np.asarray(feature_rings, dtype=np.int64)
+
+
+def _read_dbf(path, fields):
+    """
+    Read attribute columns from a dBASE table.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    n_records, header_length, record_length = struct.unpack("<IHH", data[4:12])
+
+    dtype = [("deleted", "S1")]
+    kinds = {}
+    pos = 32
+    while data[pos] != 0x0D:
+        name = data[pos:pos + 11].split(b"\x00")[0].decode("ascii")
+        kinds[name] = chr(data[pos + 11])
+        dtype.append((name, f"S{data[pos + 16]}"))
+        pos += 32
+
+    records = np.frombuffer(data, dtype=np.dtype(dtype), count=n_records, offset=header_length)
+    columns = {}
+    for name in fields:
+        column = np.char.strip(np.char.decode(records[name], "latin-1"))
+        if kinds[name] in "NF":
+            column = np.array([float(v) if v else np.nan for v in column])
+        columns[name] = column
+    return columns
+
+
+class GeometryStore:
+
+    def __init__(self, coords, ring_offsets, part_offsets, feature_offsets, attributes=None):
+        """
+        Columnar polygon geometry.
+
+        Vertices of every ring are stacked in coords. Rings, parts
+        and features are delimited by offset arrays: the vertices of
+        ring r are coords[ring_offsets[r]:ring_offsets[r + 1]], the
+        rings of part p are part_offsets[p]:part_offsets[p + 1] and
+        the parts of feature f are feature_offsets[f]:feature_offsets[f + 1].
+        The first ring of each part is its exterior and the rest are
+        holes. Rings are closed (the last vertex repeats the first).
+        """
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.int64)
+        self.feature_offsets = np.asarray(feature_offsets, dtype=np.int64)
+        self.attributes = dict(attributes or {})
+
+    def __len__(self):
+        return len(self.feature_offsets) - 1
+
+    @classmethod
+    def from_shapefile(cls, path, fields=()):
+        """
+        Parse a polygon shapefile. Clockwise rings start a new part
+        and the counter-clockwise rings that follow are its holes.
+        """
+        coords, ring_offsets, feature_rings = _read_shp(path)
+        attributes = {}
+        if fields:
+            attributes = _read_dbf(os.path.splitext(path)[0] + os.extsep + "dbf", fields)
+
+        # a clockwise (exterior) ring, or the first ring of a feature, starts a part
+        ring_feature_offsets = _offsets(feature_rings)
+        is_start = _signed_ring_areas(coords, ring_offsets) < 0
+        is_start[ring_feature_offsets[:-1][feature_rings > 0]] = True
+        starts = np.nonzero(is_start)[0]
+
+        part_offsets = np.append(starts, len(ring_offsets) - 1)
+        feature_offsets = np.searchsorted(starts, ring_feature_offsets)
+        return cls(coords, ring_offsets, part_offsets, feature_offsets, attributes)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            attributes = {k[len("attr_"):]: data[k] for k in data.files if k.startswith("attr_")}
+            return cls(
+                data["coords"],
+                data["ring_offsets"],
+                data["part_offsets"],
+                data["feature_offsets"],
+                attributes
+            )
+
+    def save(self, path):
+        np.savez(
+            path,
+            coords=self.coords,
+            ring_offsets=self.ring_offsets,
+            part_offsets=self.part_offsets,
+            feature_offsets=self.feature_offsets,
+            **{f"attr_{k}": v for k, v in self.attributes.items()}
+        )
+
+    def ring_areas(self):
+        """
+        Unsigned area of every ring.
+        """
+        return np.abs(_signed_ring_areas(self.coords, self.ring_offsets))
+
+    def part_areas(self):
+        """
+        Area of every part, exterior less holes.
+        """
+        sign = -np.ones(len(self.ring_offsets) - 1)
+        sign[self.part_offsets[:-1]] = 1
+        return _segment_sum(sign * self.ring_areas(), self.part_offsets)
+
+    def feature_areas(self):
+        return _segment_sum(self.part_areas(), self.feature_offsets)
+
+    def largest_parts(self):
+        """
+        Index of the largest part of every non-empty feature.
+        """
+        counts = np.diff(self.feature_offsets)
+        part_feature = np.repeat(np.arange(len(self)), counts)
+        order = np.lexsort((self.part_areas(), part_feature))
+        return order[self.feature_offsets[1:][counts > 0] - 1]
+
+    def largest_ring(self):
+        """
+        The exterior ring of the largest part of the largest feature,
+        e.g. the main shoreline of an island.
+        """
+        feature = np.argmax(self.feature_areas())
+        first, last = self.feature_offsets[feature], self.feature_offsets[feature + 1]
+        part = first + np.argmax(self.part_areas()[first:last])
+        ring = self.part_offsets[part]
+        return self.coords[self.ring_offsets[ring]:self.ring_offsets[ring + 1]]
+
+    def bounds(self):
+        """
+        Bounding box (xmin, ymin, xmax, ymax) of every feature.
+        Empty features get an inverted (empty) box.
+        """
+        bounds = np.tile([np.inf, np.inf, -np.inf, -np.inf], (len(self), 1))
+        counts = np.diff(self.feature_offsets)
+        nonempty = counts > 0
+        vertex_offsets = self.ring_offsets[self.part_offsets[self.feature_offsets]]
+        starts = vertex_offsets[:-1][nonempty]
+        if len(starts):
+            x, y = self.coords[:, 0], self.coords[:, 1]
+            bounds[nonempty] = np.stack([
+                np.minimum.reduceat(x, starts),
+                np.minimum.reduceat(y, starts),
+                np.maximum.reduceat(x, starts),
+                np.maximum.reduceat(y, starts)
+            ], axis=1)
+        return bounds
+
+    def select(self, features):
+        """
+        A new store with only the given features.
+        """
+        features = np.asarray(features, dtype=np.int64)
+        parts = _ranges(self.feature_offsets[features], self.feature_offsets[features + 1])
+        return self._take(features, parts, np.diff(self.feature_offsets)[features])
+
+    def select_parts(self, parts):
+        """
+        A new store with one feature per given part.
+        """
+        parts = np.asarray(parts, dtype=np.int64)
+        features = np.searchsorted(self.feature_offsets, parts, side="right") - 1
+        return self._take(features, parts, np.ones(len(parts), dtype=np.int64))
+
+    def exteriors(self):
+        """
+        A new store with the holes of every part removed.
+        """
+        rings = self.part_offsets[:-1]
+        coords = self.coords[_ranges(self.ring_offsets[rings], self.ring_offsets[rings + 1])]
+        return GeometryStore(
+            coords,
+            _offsets(np.diff(self.ring_offsets)[rings]),
+            np.arange(len(rings) + 1),
+            self.feature_offsets,
+            self.attributes
+        )
+
+    def rings(self, feature):
+        """
+        The rings of a feature as a list of (N, 2) arrays.
+        """
+        p0, p1 = self.feature_offsets[feature], self.feature_offsets[feature + 1]
+        r0, r1 = self.part_offsets[p0], self.part_offsets[p1]
+        return np.split(self.coords[self.ring_offsets[r0]:self.ring_offsets[r1]], self.ring_offsets[r0 + 1:r1] - self.ring_offsets[r0])
+
+    def edges(self):
+        """
+        Every ring edge as rows (x1, y1, x2, y2) and the offsets of
+        the edges of each feature.
+        """
+        last = np.zeros(len(self.coords), dtype=bool)
+        last[self.ring_offsets[1:] - 1] = True
+        keep = ~last
+        edges = np.concatenate([self.coords[:-1], self.coords[1:]], axis=1)[keep[:-1]]
+        vertex_offsets = self.ring_offsets[self.part_offsets[self.feature_offsets]]
+        edge_offsets = vertex_offsets - np.concatenate([[0], np.cumsum(last)])[vertex_offsets]
+        return edges, edge_offsets
+
+    def _take(self, features, parts, feature_parts):
+        rings = _ranges(self.part_offsets[parts], self.part_offsets[parts + 1])
+        coords = self.coords[_ranges(self.ring_offsets[rings], self.ring_offsets[rings + 1])]
+        return GeometryStore(
+            coords,
+            _offsets(np.diff(self.ring_offsets)[rings]),
+            _offsets(np.diff(self.part_offsets)[parts]),
+            _offsets(feature_parts),
+            {k: v[features] for k, v in self.attributes.items()}
+        )
+
+
+def _segment_sum(values, offsets):
+    sums = np.zeros(len(offsets) - 1)
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(values, offsets[:-1][nonempty])
+    return sums
+
+
+def _signed_ring_areas(coords, ring_offsets):
+    """
+    Shoelace area of closed rings; negative for clockwise rings.
+    """
+    x, y = coords[:, 0], coords[:, 1]
+    cross = np.zeros(len(coords))
+    cross[:-1] = x[:-1] * y[1:] - x[1:] * y[:-1]
+    # drop the terms joining one ring to the next
+    cross[ring_offsets[1:] - 1] = 0
+    return 0.5 * _segment_sum(cross, ring_offsets)
+
+
+class STRTree:
+
+    def __init__(self, bounds, capacity=16):
+        """
+        A static R-tree over bounding boxes (xmin, ymin, xmax, ymax),
+        packed with the Sort-Tile-Recursive algorithm of Leutenegger
+        et al. Every level is stored as arrays so that queries are
+        vectorized over the nodes of a level. Empty boxes (such as
+        those of null shapes) are left out of the tree.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        self.capacity = capacity
+
+        ids = np.nonzero(np.isfinite(bounds).all(axis=1) & (bounds[:, 0] <= bounds[:, 2]) & (bounds[:, 1] <= bounds[:, 3]))[0]
+        order = self._str_order(bounds[ids])
+        self.items = ids[order]
+        self.levels = [bounds[self.items]]
+        self.children = []
+
+        level_bounds = self.levels[0]
+        while len(level_bounds) > capacity:
+            starts = np.arange(0, len(level_bounds), capacity)
+            ends = np.minimum(starts + capacity, len(level_bounds))
+            node_bounds = np.stack([
+                np.minimum.reduceat(level_bounds[:, 0], starts),
+                np.minimum.reduceat(level_bounds[:, 1], starts),
+                np.maximum.reduceat(level_bounds[:, 2], starts),
+                np.maximum.reduceat(level_bounds[:, 3], starts)
+            ], axis=1)
+            order = self._str_order(node_bounds)
+            level_bounds = node_bounds[order]
+            self.levels.append(level_bounds)
+            self.children.append((starts[order], ends[order]))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _str_order(self, bounds):
+        n = len(bounds)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        slices = int(np.ceil(np.sqrt(np.ceil(n / self.capacity))))
+        cx = bounds[:, 0] + bounds[:, 2]
+        cy = bounds[:, 1] + bounds[:, 3]
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.argsort(cx, kind="stable")] = np.arange(n)
+        slab = rank // (slices * self.capacity)
+        return np.lexsort((cy, slab))
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        Indices of the boxes intersecting the window, in ascending order.
+        """
+        candidates = np.arange(len(self.levels[-1]))
+        for level in range(len(self.levels) - 1, -1, -1):
+            b = self.levels[level][candidates]
+            hit = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+            candidates = candidates[hit]
+            if level == 0:
+                return np.sort(self.items[candidates])
+            starts, ends = self.children[level - 1]
+            candidates = _ranges(starts[candidates], ends[candidates])
+
+
+def ring_windows(ring, size, step, offset):
+    """
+    Square windows (xmin, ymin, xmax, ymax) of the given size centered
+    on points spaced step apart along a closed ring, each pushed
+    outward from the ring by offset along the local normal.
+    """
+    ring = np.asarray(ring, dtype=np.float64)
+    seg = np.hypot(*np.diff(ring, axis=0).T)
+    s = np.concatenate([[0], np.cumsum(seg)])
+    perimeter = s[-1]
+
+    def at(t):
+        t = np.mod(t, perimeter)
+        return np.stack([np.interp(t, s, ring[:, 0]), np.interp(t, s, ring[:, 1])], axis=1)
+
+    t = np.arange(0, perimeter, step)
+    points = at(t)
+    tangent = at(t + step / 2) - at(t - step / 2)
+    tangent /= np.maximum(np.hypot(*tangent.T), 1e-12)[:, None]
+
+    # the outside of a clockwise ring is to the left of its direction
+    sign = 1 if _signed_ring_areas(ring, np.array([0, len(ring)]))[0] < 0 else -1
+    normal = sign * np.stack([-tangent[:, 1], tangent[:, 0]], axis=1)
+    centers = points + offset * normal
+    return np.concatenate([centers - size / 2, centers + size / 2], axis=1)
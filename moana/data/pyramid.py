@@ -0,0 +1,163 @@
+import os
+import json
+import tempfile
+
+import numpy as np
+
+from skimage import io
+
+
+# none, land, sand, reef
+LABEL_COLORS = np.array([
+    [0, 0, 0],
+    [34, 139, 34],
+    [238, 214, 175],
+    [255, 127, 80]
+], dtype=np.uint8)
+
+
+def downsample_mode(block, classes):
+    """
+    Halve a class raster, taking the most frequent class of every
+    2x2 block (ties go to the lowest class).
+    """
+    if block.size and block.max() >= classes:
+        raise ValueError(f"Class {block.max()} out of range for {classes} classes; pass a lut")
+    h, w = block.shape[0] // 2, block.shape[1] // 2
+    quads = block[:2 * h, :2 * w].reshape(h, 2, w, 2)
+    counts = np.zeros((h, w, classes), dtype=np.uint8)
+    for c in range(classes):
+        counts[..., c] = (quads == c).sum(axis=(1, 3))
+    return counts.argmax(axis=2).astype(block.dtype)
+
+
+def downsample_mean(block):
+    """
+    Halve an image, averaging every 2x2 block.
+    """
+    h, w = block.shape[0] // 2, block.shape[1] // 2
+    quads = block[:2 * h, :2 * w].reshape((h, 2, w, 2) + block.shape[2:])
+    return np.round(quads.mean(axis=(1, 3), dtype=np.float32)).astype(block.dtype)
+
+
+def colorize(tile, kind, palette=LABEL_COLORS):
+    if kind == "label":
+        if tile.size and tile.max() >= len(palette):
+            raise ValueError(f"Class {tile.max()} has no color; pass a lut or a larger palette")
+        lut = np.zeros((256, 3), dtype=np.uint8)
+        lut[:len(palette)] = palette
+        return lut[tile]
+    if tile.ndim == 2:
+        return np.repeat(tile[..., None], 3, axis=2)
+    if tile.shape[2] < 3:
+        raise ValueError(f"Images need 1 or at least 3 channels, got {tile.shape[2]}")
+    return tile[..., :3]
+
+
+def _write_tiles(level, dirname, kind, tile, lut=None):
+    H, W = level.shape[:2]
+    for i in range(0, H, tile):
+        os.makedirs(os.path.join(dirname, str(i // tile)), exist_ok=True)
+        for j in range(0, W, tile):
+            path = os.path.join(dirname, str(i // tile), f"{j // tile}{os.extsep}png")
+            block = np.asarray(level[i:i + tile, j:j + tile])
+            if lut is not None:
+                block = lut[block]
+            io.imsave(path, colorize(block, kind), check_contrast=False)
+
+
+def build_pyramid(source, out_dir, kind="label", tile=256, classes=4, rows=256, lut=None):
+    """
+    Build a tiled, colorized overview pyramid of a prediction raster,
+    habitat mask (kind="label") or mosaic (kind="image").
+
+    source is an array or the path to a .npy or uncompressed .tif
+    file, which is memory mapped (the latter with tifffile). Each
+    level halves the previous one with block-wise mode (labels) or
+    average (images) downsampling, streamed rows output rows at a
+    time into a temporary memory-mapped .npy, until a level fits in
+    a single tile. Tiles are written to
+    out_dir/<level>/<row>/<col>.png, with level 0 at full
+    resolution. Single-band images are written as grayscale.
+
+    Labels must be classes below classes. Rasters of raw habitat
+    codes (e.g. masks written with aggregate=False) are mapped to
+    classes with a lut such as rasterize.aggregate_lut().
+
+    Note: An odd trailing row or column is dropped when halving.
+    """
+    if isinstance(source, str):
+        if source.lower().endswith((".tif", ".tiff")):
+            import tifffile
+            source = tifffile.memmap(source, mode="r")
+        else:
+            source = np.load(source, mmap_mode="r")
+    os.makedirs(out_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as temp_dir:
+        shapes = _build_levels(source, out_dir, temp_dir, kind, tile, classes, rows, lut)
+
+    with open(os.path.join(out_dir, f"pyramid{os.extsep}json"), "w") as f:
+        json.dump({"kind": kind, "tile": tile, "shapes": shapes}, f)
+    return len(shapes)
+
+
+def _build_levels(source, out_dir, temp_dir, kind, tile, classes, rows, lut):
+    level = source
+    shapes = []
+    while True:
+        shapes.append(level.shape[:2])
+        level_lut = lut if level is source else None
+        _write_tiles(level, os.path.join(out_dir, str(len(shapes) - 1)), kind, tile, lut=level_lut)
+        if max(level.shape[:2]) <= tile or min(level.shape[:2]) < 2:
+            break
+
+        H, W = level.shape[0] // 2, level.shape[1] // 2
+        path = os.path.join(temp_dir, f"level-{len(shapes)}{os.extsep}npy")
+        dtype = level.dtype if level_lut is None else level_lut.dtype
+        downsampled = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(H, W) + level.shape[2:])
+        for r in range(0, H, rows):
+            block = np.asarray(level[2 * r:2 * (r + rows)])
+            if level_lut is not None:
+                block = level_lut[block]
+            if kind == "label":
+                downsampled[r:r + rows] = downsample_mode(block, classes)
+            else:
+                downsampled[r:r + rows] = downsample_mean(block)
+        downsampled.flush()
+        level = downsampled
+    return shapes
+
+
+def read_overview(out_dir, window=None, max_size=1024):
+    """
+    Read the region of a pyramid given by the level 0 pixel window
+    (row0, col0, row1, col1), at the finest level where it is at most
+    max_size pixels on a side. Only the tiles covering the region are
+    read. Returns the RGB region and its level.
+    """
+    with open(os.path.join(out_dir, f"pyramid{os.extsep}json")) as f:
+        meta = json.load(f)
+    tile = meta["tile"]
+    shapes = meta["shapes"]
+
+    if window is None:
+        window = (0, 0) + tuple(shapes[0])
+    row0, col0, row1, col1 = window
+
+    level = 0
+    while level < len(shapes) - 1 and max(row1 - row0, col1 - col0) > max_size * 2 ** level:
+        level += 1
+    H, W = shapes[level]
+    row0, col0 = row0 >> level, col0 >> level
+    row1, col1 = min(row1 >> level, H), min(col1 >> level, W)
+
+    region = np.zeros((row1 - row0, col1 - col0, 3), dtype=np.uint8)
+    for ti in range(row0 // tile, (row1 - 1) // tile + 1):
+        for tj in range(col0 // tile, (col1 - 1) // tile + 1):
+            image = io.imread(os.path.join(out_dir, str(level), str(ti), f"{tj}{os.extsep}png"))[..., :3]
+            i0, j0 = ti * tile, tj * tile
+            a0, b0 = max(row0, i0), max(col0, j0)
+            a1, b1 = min(row1, i0 + image.shape[0]), min(col1, j0 + image.shape[1])
+            region[a0 - row0:a1 - row0, b0 - col0:b1 - col0] = image[a0 - i0:a1 - i0, b0 - j0:b1 - j0]
+    return region, level
@@ -0,0 +1,194 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from skimage import io
+
+try:
+    from .geometry import STRTree
+except ImportError:
+    # imported as a script module alongside extract.py
+    from geometry import STRTree
+
+
+NODATA = 15
+
+
+def aggregate_lut():
+    """
+    Lookup table from raw habitat codes to aggregate classes.
+    Mirrors MoanaDataset._aggregate_label.
+        - land, 1  -> 1
+        - sand, 2  -> 2
+        - ????, 3  -> 0
+        - reef, 4  -> 3
+        - none, 15 -> 0
+    """
+    lut = np.arange(256, dtype=np.uint8)
+    lut[3] = 0
+    lut[15] = 0
+    lut[4] = 3
+    return lut
+
+
+class PolygonIndex:
+
+    def __init__(self, store, codes, field="M_STRUCT"):
+        """
+        Edges, codes and STR-tree of habitat polygons from a
+        GeometryStore. Exterior rings and holes are not distinguished;
+        the scanline fill uses the even-odd rule.
+
+        Note: codes maps field values to the raw mask codes that
+              _aggregate_label expects (land 1, sand 2, reef 4). It
+              must match the arcpy-produced masks; see check_codes.
+        """
+        values = store.attributes[field]
+        unknown = sorted(set(values) - set(codes))
+        if unknown:
+            raise ValueError(f"No habitat code for {field} values {unknown}")
+        self.codes = codes
+
+        self.edges, self.offsets = store.edges()
+        self.values = np.array([codes[value] for value in values], dtype=np.uint8)
+        self.tree = STRTree(store.bounds())
+
+    def __len__(self):
+        return len(self.values)
+
+    def feature_edges(self, i):
+        return self.edges[self.offsets[i]:self.offsets[i + 1]]
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        Indices of polygons whose bounding box intersects the window.
+        """
+        return self.tree.query(xmin, ymin, xmax, ymax)
+
+
+def scanline_fill(edges, origin, cell, shape):
+    """
+    Rasterize a polygon given by its edges with the even-odd rule.
+    A pixel is inside if its center is inside the polygon.
+
+    origin is the (x, y) upper-left corner of the window.
+    """
+    H, W = shape
+    x0, y0 = origin
+    x1, y1, x2, y2 = edges.T
+
+    # rows whose pixel centers lie in [min(y1, y2), max(y1, y2))
+    ylo = np.minimum(y1, y2)
+    yhi = np.maximum(y1, y2)
+    r_start = np.floor((y0 - yhi) / cell - 0.5).astype(np.int64) + 1
+    r_end = np.floor((y0 - ylo) / cell - 0.5).astype(np.int64)
+    r_start = np.maximum(r_start, 0)
+    r_end = np.minimum(r_end, H - 1)
+    counts = np.maximum(r_end - r_start + 1, 0)
+    counts[ylo == yhi] = 0
+
+    total = counts.sum()
+    if total == 0:
+        return np.zeros(shape, dtype=bool)
+
+    # one entry per (edge, row) crossing
+    edge = np.repeat(np.arange(len(edges)), counts)
+    rows = np.repeat(r_start - np.cumsum(counts) + counts, counts) + np.arange(total)
+    yc = y0 - (rows + 0.5) * cell
+    xc = x1[edge] + (yc - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+    cols = np.clip(np.ceil((xc - x0) / cell - 0.5), 0, W).astype(np.int64)
+
+    # crossings toggle every pixel to their right
+    crossings = np.zeros((H, W + 1), dtype=np.int32)
+    np.add.at(crossings, (rows, cols), 1)
+    return (np.cumsum(crossings[:, :W], axis=1) & 1).astype(bool)
+
+
+def rasterize_window(index, origin, cell, shape, aggregate=False):
+    """
+    Rasterize the habitat polygons intersecting a window. Only the
+    polygons returned by the index are scanned, so the cost is
+    proportional to the window rather than the island.
+
+    With aggregate, polygon codes are mapped to aggregate classes
+    before they are burned in.
+    """
+    H, W = shape
+    x0, y0 = origin
+    values = index.values
+    nodata = NODATA
+    if aggregate:
+        lut = aggregate_lut()
+        values = lut[values]
+        nodata = lut[nodata]
+
+    out = np.full(shape, nodata, dtype=np.uint8)
+    for i in index.query(x0, y0 - H * cell, x0 + W * cell, y0):
+        out[scanline_fill(index.feature_edges(i), origin, cell, shape)] = values[i]
+    return out
+
+
+def snap_window(extent, grid_origin, cell):
+    """
+    Snap an extent (xmin, ymin, xmax, ymax) to the pixel grid of a
+    raster with the given upper-left origin and cell size. Returns
+    the window's upper-left corner and its shape.
+    """
+    xmin, ymin, xmax, ymax = extent
+    gx0, gy0 = grid_origin
+    col = math.floor((xmin - gx0) / cell)
+    row = math.floor((gy0 - ymax) / cell)
+    W = int(round((xmax - xmin) / cell))
+    H = int(round((ymax - ymin) / cell))
+    return (gx0 + col * cell, gy0 - row * cell), (H, W)
+
+
+def check_codes(index, windows, cell, min_agreement=0.99):
+    """
+    Compare the rasterization of (path, origin, shape) windows with
+    the existing masks at their paths (e.g. written by the arcpy
+    pipeline). Returns the fraction of agreeing pixels, or None if
+    there is no existing mask, and raises if it is below
+    min_agreement.
+    """
+    agree = 0
+    total = 0
+    for path, origin, shape in windows:
+        if not os.path.exists(path):
+            continue
+        reference = io.imread(path)
+        mask = rasterize_window(index, origin, cell, shape)
+        H, W = min(mask.shape[0], reference.shape[0]), min(mask.shape[1], reference.shape[1])
+        agree += (mask[:H, :W] == reference[:H, :W]).sum()
+        total += H * W
+    if total == 0:
+        return None
+    agreement = agree / total
+    if agreement < min_agreement:
+        raise ValueError(f"Habitat codes agree with existing masks on {agreement:.1%} of pixels")
+    return agreement
+
+
+_index = None
+
+
+def _init_worker(index):
+    global _index
+    _index = index
+
+
+def _rasterize_to_file(args):
+    path, origin, cell, shape, aggregate = args
+    io.imsave(path, rasterize_window(_index, origin, cell, shape, aggregate=aggregate), check_contrast=False)
+    return path
+
+
+def rasterize_windows(index, windows, cell, aggregate=False, workers=None):
+    """
+    Rasterize (path, origin, shape) windows to PNG files in parallel.
+    """
+    jobs = [(path, origin, cell, shape, aggregate) for path, origin, shape in windows]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as pool:
+        return list(pool.map(_rasterize_to_file, jobs, chunksize=16))
@@ -1,2 +1,5 @@
 from model import utils
-from model import modules
\ No newline at end of file
+from model import modules
+from model import inference
+from model import checkpoint
+from model import cache
\ No newline at end of file
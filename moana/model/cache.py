@@ -0,0 +1,82 @@
+import os
+import hashlib
+
+import numpy as np
+
+import torch
+
+
+def model_digest(model):
+    """
+    SHA-256 of a model's parameters and buffers.
+    """
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        tensor = tensor.detach().cpu().contiguous()
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        digest.update(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+class WindowCache:
+
+    def __init__(self, dirname, model, preprocess=""):
+        """
+        Content-addressed cache of per-window predictions.
+
+        Entries are keyed by a hash of the window pixels, the model
+        weights and a preprocess tag, so repeated inference (e.g. over
+        another survey year) only recomputes windows whose inputs
+        changed.
+
+        Note: predict_mosaic adds the window size, TTA transforms and
+              screen settings to each key itself. preprocess should
+              describe anything else that affects a prediction, such
+              as how the mosaic was produced.
+        """
+        self.dirname = dirname
+        self.context = hashlib.sha256(f"{model_digest(model)}:{preprocess}".encode()).digest()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(dirname, exist_ok=True)
+
+    def key(self, window, context=""):
+        """
+        Key of a window, mixing in a per-call context string.
+        """
+        window = np.ascontiguousarray(window)
+        digest = hashlib.sha256(self.context)
+        digest.update(f"{context}:".encode())
+        digest.update(f"{window.dtype}:{window.shape}".encode())
+        digest.update(window.tobytes())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.dirname, key[:2], f"{key}{os.extsep}npy")
+
+    def get(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            self.hits += 1
+            return np.load(path)
+        self.misses += 1
+        return None
+
+    def put(self, key, prediction):
+        path = self.path(key)
+        temp = f"{path}{os.extsep}{os.getpid()}{os.extsep}tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp, "wb") as f:
+            np.save(f, np.asarray(prediction))
+        os.replace(temp, path)
+
+    def stats(self):
+        """
+        Lookups since the cache was created, across all runs.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
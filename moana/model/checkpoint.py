@@ -0,0 +1,137 @@
+import os
+import re
+import copy
+import random
+import threading
+
+import torch
+
+
+def _to_host(obj):
+    """
+    Copy every tensor in a (nested) state dict to host memory.
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_host(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_host(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def _rng_state():
+    state = {
+        "python": random.getstate(),
+        "torch": torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    random.setstate(state["python"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class AsyncCheckpointer:
+
+    def __init__(self, dirname, keep=3, prefix="checkpoint"):
+        """
+        Non-blocking checkpointing of a training run.
+
+        save snapshots the model, optimizer, sampler, metrics and RNG
+        state to host memory and writes it on a background thread.
+        Files are written to a temporary name and renamed into place,
+        so a crash never leaves a partial checkpoint. Only the latest
+        keep checkpoints are retained.
+
+        Note: At most one write is in flight. A save issued while the
+              previous write is still running waits for it first.
+        """
+        if keep < 1:
+            raise ValueError(f"keep must be at least 1, got {keep}")
+        self.dirname = dirname
+        self.keep = keep
+        self.prefix = prefix
+        self._thread = None
+        self._error = None
+        os.makedirs(dirname, exist_ok=True)
+
+    def path(self, step):
+        return os.path.join(self.dirname, f"{self.prefix}-{step:09d}{os.extsep}pt")
+
+    def checkpoints(self):
+        """
+        Paths of the retained checkpoints, oldest first.
+        """
+        pattern = re.compile(rf"^{re.escape(self.prefix)}-(\d+){re.escape(os.extsep)}pt$")
+        steps = []
+        for name in os.listdir(self.dirname):
+            match = pattern.match(name)
+            if match:
+                steps.append(int(match.group(1)))
+        return [self.path(step) for step in sorted(steps)]
+
+    def latest(self):
+        paths = self.checkpoints()
+        return paths[-1] if paths else None
+
+    def save(self, step, model, optimizer, sampler=None, metrics=None):
+        self.wait()
+        state = {
+            "step": step,
+            "model": _to_host(model.state_dict()),
+            "optimizer": _to_host(optimizer.state_dict()),
+            "sampler": None if sampler is None else sampler.state_dict(),
+            "metrics": copy.deepcopy(metrics),
+            "rng": _rng_state()
+        }
+        self._thread = threading.Thread(target=self._write, args=(step, state), daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """
+        Block until the pending write is on disk, re-raising its error.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def load(self, model, optimizer=None, sampler=None, path=None, map_location="cpu"):
+        """
+        Restore a checkpoint (the latest by default) and return its
+        step and metrics, or None if there is no checkpoint.
+        """
+        self.wait()
+        path = path or self.latest()
+        if path is None:
+            return None
+        state = torch.load(path, map_location=map_location)
+        model.load_state_dict(state["model"])
+        if optimizer is not None:
+            optimizer.load_state_dict(state["optimizer"])
+        if sampler is not None and state["sampler"] is not None:
+            sampler.load_state_dict(state["sampler"])
+        _set_rng_state(state["rng"])
+        return state["step"], state["metrics"]
+
+    def _write(self, step, state):
+        try:
+            path = self.path(step)
+            temp = f"{path}{os.extsep}tmp"
+            with open(temp, "wb") as f:
+                torch.save(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+            for old in self.checkpoints()[:-self.keep]:
+                os.remove(old)
+        except Exception as error:
+            self._error = error
@@ -0,0 +1,325 @@
+import hashlib
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+
+from data.geometry import STRTree
+
+
+# The dihedral group D4 as (quarter turns, flip) pairs. These are the
+# same 8 views produced by the training augmentation (horizontal flip,
+# vertical flip and rotation by multiples of 90 degrees).
+D4 = [(k, flip) for flip in (False, True) for k in range(4)]
+
+
+def d4_forward(x, k, flip):
+    """
+    Apply a D4 transform to a batch of shape (N, C, H, W).
+    """
+    out = torch.rot90(x, k, dims=(2, 3))
+    if flip:
+        out = torch.flip(out, dims=(3,))
+    return out
+
+
+def d4_inverse(x, k, flip):
+    """
+    Invert d4_forward on a batch of shape (N, C, H, W).
+    """
+    out = x
+    if flip:
+        out = torch.flip(out, dims=(3,))
+    return torch.rot90(out, -k, dims=(2, 3))
+
+
+class TTA(nn.Module):
+
+    def __init__(self, model, transforms=None, **kwargs):
+        """
+        Test-time augmentation over the dihedral group D4.
+
+        The transformed views of each tile are stacked into a single
+        batch so the wrapped model runs one forward pass. The logits
+        are mapped back through the inverse transforms and averaged.
+
+        Note: transforms is a subset of D4, given either as indices
+              into D4 or as (quarter turns, flip) pairs. Odd quarter
+              turns require square tiles.
+        """
+        super().__init__(**kwargs)
+
+        if transforms is None:
+            transforms = D4
+        self.model = model
+        self.transforms = [D4[t] if isinstance(t, int) else tuple(t) for t in transforms]
+
+    def forward(self, x):
+        N, _, H, W = x.shape
+        if H != W and any(k % 2 for k, _ in self.transforms):
+            raise ValueError(f"Odd quarter turns require square tiles, got {H}x{W}")
+        views = torch.cat([d4_forward(x, k, flip) for k, flip in self.transforms], dim=0)
+        outs = self.model(views).split(N, dim=0)
+        out = torch.zeros_like(outs[0])
+        for (k, flip), logits in zip(self.transforms, outs):
+            out += d4_inverse(logits, k, flip)
+        return out / len(self.transforms)
+
+
+class StatisticsScreen:
+
+    def __init__(self, max_std=0.02, max_mean=0.25, nodata=0, none_class=0):
+        """
+        Cheap pre-screen for trivially uniform windows, using mosaic
+        statistics only.
+
+        Windows that are entirely nodata (outside the mosaic footprint)
+        and windows of dark, nearly constant open water (every channel
+        with standard deviation at most max_std and mean at most
+        max_mean, in [0, 1] units) are filled with none_class. Every
+        other window goes to the full model; see LandScreen for
+        interior land.
+
+        Note: The thresholds depend on the mosaic. Check them with
+              screen_agreement before relying on the screen.
+        """
+        self.max_std = max_std
+        self.max_mean = max_mean
+        self.nodata = nodata
+        self.none_class = none_class
+
+    def __call__(self, x, origins=None):
+        """
+        Returns the fill class of each window, or -1 for windows
+        that need the full model.
+        """
+        empty = (x == self.nodata / 255).flatten(1).all(1)
+        pixels = x.flatten(2)
+        water = (pixels.std(dim=2) <= self.max_std).all(1)
+        water &= (pixels.mean(dim=2) <= self.max_mean).all(1)
+        fill = torch.full((len(x),), -1, dtype=torch.long, device=x.device)
+        fill[empty | water] = self.none_class
+        return fill
+
+    def key(self):
+        """
+        Settings that change the fill, for cache keys.
+        """
+        return f"statistics:{self.max_std}:{self.max_mean}:{self.nodata}:{self.none_class}"
+
+
+class LandScreen:
+
+    def __init__(self, ring, grid_origin, cell, size, margin=0.0, land_class=1):
+        """
+        Pre-screen for interior land using the shoreline geometry.
+
+        A window is filled with land_class when its square lies inside
+        the shoreline ring (e.g. GeometryStore.largest_ring of the
+        trimmed shoreline) and no shoreline edge comes within margin
+        map units of it. Edges are indexed with an STRTree, so each
+        window costs one tree query and, for the few windows near
+        no edge, one point-in-polygon test.
+
+        grid_origin is the (x, y) upper-left corner of the mosaic and
+        cell its pixel size, as used by predict_mosaic for windows of
+        the given size in pixels.
+        """
+        ring = np.asarray(ring, dtype=np.float64)
+        self.edges = np.concatenate([ring[:-1], ring[1:]], axis=1)
+        self.tree = STRTree(np.stack([
+            np.minimum(self.edges[:, 0], self.edges[:, 2]),
+            np.minimum(self.edges[:, 1], self.edges[:, 3]),
+            np.maximum(self.edges[:, 0], self.edges[:, 2]),
+            np.maximum(self.edges[:, 1], self.edges[:, 3])
+        ], axis=1))
+        self.grid_origin = grid_origin
+        self.cell = cell
+        self.size = size
+        self.margin = margin
+        self.land_class = land_class
+
+    def _inside(self, x, y):
+        """
+        Even-odd test of a point against the ring.
+        """
+        x1, y1, x2, y2 = self.edges.T
+        crosses = (y1 <= y) != (y2 <= y)
+        xc = x1[crosses] + (y - y1[crosses]) * (x2[crosses] - x1[crosses]) / (y2[crosses] - y1[crosses])
+        return bool((xc > x).sum() & 1)
+
+    def __call__(self, x, origins):
+        x0, y0 = self.grid_origin
+        extent = self.size * self.cell
+        fill = torch.full((len(x),), -1, dtype=torch.long, device=x.device)
+        for n, (i, j) in enumerate(origins):
+            xmin, ymax = x0 + j * self.cell, y0 - i * self.cell
+            xmax, ymin = xmin + extent, ymax - extent
+            m = self.margin
+            if len(self.tree.query(xmin - m, ymin - m, xmax + m, ymax + m)):
+                continue
+            if self._inside((xmin + xmax) / 2, (ymin + ymax) / 2):
+                fill[n] = self.land_class
+        return fill
+
+    def key(self):
+        """
+        Settings that change the fill, for cache keys.
+        """
+        digest = hashlib.sha256(np.ascontiguousarray(self.edges).tobytes()).hexdigest()
+        return f"land:{digest}:{self.grid_origin}:{self.cell}:{self.size}:{self.margin}:{self.land_class}"
+
+
+def _apply_screens(screens, x, origins):
+    fill = torch.full((len(x),), -1, dtype=torch.long, device=x.device)
+    for screen in screens:
+        fill = torch.where(fill < 0, screen(x, origins), fill)
+    return fill
+
+
+def _as_screens(screen):
+    if screen is None:
+        return []
+    if isinstance(screen, (list, tuple)):
+        return list(screen)
+    return [screen]
+
+
+def _preprocess_key(model, size, screens):
+    """
+    Describe what besides the window pixels and model weights
+    affects a prediction: the window size, the TTA transforms and
+    the screen settings. Screens without a key method are described
+    by their attributes.
+    """
+    transforms = model.transforms if isinstance(model, TTA) else None
+    keys = [screen.key() if hasattr(screen, "key") else f"{type(screen).__name__}:{sorted(vars(screen).items())}"
+            for screen in screens]
+    return f"{size}:{transforms}:{keys}"
+
+
+def screen_agreement(model, mosaic, size, screen, batch_size=8):
+    """
+    Run the full model on the windows a screen (or list of screens)
+    would fill and measure how often it agrees with the fill. Returns the number
+    of screened windows and the fraction of their pixels where the
+    full prediction equals the fill class.
+    """
+    device = next(model.parameters()).device
+    screens = _as_screens(screen)
+    H, W = mosaic.shape[:2]
+    windows = [(i, j) for i in window_origins(H, size) for j in window_origins(W, size)]
+    screened = 0
+    agree = 0
+
+    with torch.no_grad():
+        for b in range(0, len(windows), batch_size):
+            batch = windows[b:b + batch_size]
+            x = np.stack([mosaic[i:i + size, j:j + size, :3] for i, j in batch])
+            x = torch.from_numpy(x).to(device).permute(0, 3, 1, 2).float() / 255
+            fill = _apply_screens(screens, x, batch)
+            hit = fill >= 0
+            if hit.any():
+                pred = torch.argmax(model(x[hit]), dim=1)
+                agree += (pred == fill[hit].view(-1, 1, 1)).sum().item()
+                screened += int(hit.sum().item())
+
+    agreement = agree / (screened * size * size) if screened else 1.0
+    return screened, agreement
+
+
+def window_origins(length, size):
+    """
+    Origins of windows tiling [0, length) with the final window
+    shifted back to end flush with the edge.
+    """
+    if length < size:
+        raise ValueError(f"Window of size {size} exceeds extent {length}")
+    origins = list(range(0, length - size + 1, size))
+    if origins[-1] + size < length:
+        origins.append(length - size)
+    return origins
+
+
+def predict_mosaic(model, mosaic, size, batch_size=8, screen=None, cache=None):
+    """
+    Predict a class raster for an island mosaic of shape (H, W, C)
+    by tiling it with windows of the given size. With a screen or
+    list of screens (e.g. StatisticsScreen for open water and
+    LandScreen for interior land) uniform windows skip the full
+    model and are filled with a constant class. With a cache (a
+    WindowCache) windows seen before are read back from disk; the
+    window size, TTA transforms and screen settings are part of
+    their keys.
+
+    Returns the class raster and a dictionary of statistics for
+    this call. skipped_fraction counts only windows filled by the
+    screens, and skipped_classes breaks them down by fill class;
+    windows read from the cache are reported separately as
+    cache hits.
+    """
+    device = next(model.parameters()).device
+    screens = _as_screens(screen)
+    if cache is not None:
+        hits, misses = cache.hits, cache.misses
+        context = _preprocess_key(model, size, screens)
+    H, W = mosaic.shape[:2]
+    labels = np.zeros((H, W), dtype=np.uint8)
+
+    windows = [(i, j) for i in window_origins(H, size) for j in window_origins(W, size)]
+    skipped = {}
+
+    with torch.no_grad():
+        for b in range(0, len(windows), batch_size):
+            batch = windows[b:b + batch_size]
+            x = np.stack([mosaic[i:i + size, j:j + size, :3] for i, j in batch])
+
+            # fill windows already in the cache
+            if cache is not None:
+                keys = [cache.key(window, context) for window in x]
+                todo = []
+                for n, ((i, j), key) in enumerate(zip(batch, keys)):
+                    prediction = cache.get(key)
+                    if prediction is None:
+                        todo.append(n)
+                    else:
+                        labels[i:i + size, j:j + size] = prediction
+                if not todo:
+                    continue
+                batch = [batch[n] for n in todo]
+                keys = [keys[n] for n in todo]
+                x = x[todo]
+
+            x = torch.from_numpy(x).to(device).permute(0, 3, 1, 2).float() / 255
+
+            fill = _apply_screens(screens, x, batch)
+
+            run = fill < 0
+            if run.any():
+                pred = torch.argmax(model(x[run]), dim=1)
+                fill_pred = iter(pred.cpu().numpy().astype(np.uint8))
+            for n, ((i, j), f, r) in enumerate(zip(batch, fill.tolist(), run.tolist())):
+                if r:
+                    prediction = next(fill_pred)
+                else:
+                    prediction = np.uint8(f)
+                    skipped[f] = skipped.get(f, 0) + 1
+                labels[i:i + size, j:j + size] = prediction
+                if cache is not None:
+                    cache.put(keys[n], prediction)
+
+    stats = {
+        "windows": len(windows),
+        "skipped": sum(skipped.values()),
+        "skipped_fraction": sum(skipped.values()) / len(windows),
+        "skipped_classes": skipped
+    }
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+        stats.update({
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        })
+    return labels, stats